@@ -20,8 +20,8 @@ if __name__ == '__main__':
                           **parser.get_system_config(),
                           **parser.get_output_config())
 
-    ip_trace, load_trace = trace_preprocessor.preprocess()
+    ip_trace, addr_trace, tag_trace, block_trace = trace_preprocessor.preprocess()
 
     prefetcher.initialize()
-    prefetcher.start(ip_trace, load_trace)
+    prefetcher.start(ip_trace, addr_trace, tag_trace, block_trace)
     prefetcher.stop()
\ No newline at end of file
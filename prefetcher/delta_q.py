@@ -14,10 +14,36 @@
 # BUT, there is no point in trying to fetch a block at offsets not in the range [-63, 63] because we don't
 # know the physical address of the next page, so the valid deltas are still [-63, 63]
 
+import random
 import numpy as np
+from numba import njit
 from utils.signature_hash import SignatureHash
 
 
+@njit(cache=True, fastmath=True)
+def _row_argmax(q_table, row):
+    """ Returns the index of the (first) largest Q-value in the given row of the raw Q-table """
+    best_idx = 0
+    best_q = q_table[row, 0]
+    for k in range(1, q_table.shape[1]):
+        if q_table[row, k] > best_q:
+            best_q = q_table[row, k]
+            best_idx = k
+
+    return best_idx
+
+
+@njit(cache=True, fastmath=True)
+def _q_update(q_table, s_curr, a_curr, s_next, alpha, gamma, reward):
+    """
+    Applies the Q-learning update rule in-place on the raw (float32) Q-table (see DeltaQTable.update)
+    alpha and gamma are expected to be float32 already, the reward is cast here so that all the arithmetic stays
+    in float32
+    """
+    max_q_next = q_table[s_next, _row_argmax(q_table, s_next)]
+    q_table[s_curr, a_curr] += alpha*(np.float32(reward) + gamma*max_q_next - q_table[s_curr, a_curr])
+
+
 class DeltaQTable:
     """
 
@@ -41,6 +67,10 @@ class DeltaQTable:
         self.cache_line_size_bytes = cache_line_size_bytes
         self.delta_q_table = None
 
+        # The Q-table is kept as float32, so keep the float32 versions of the values used by the update rule
+        self._alpha_f32 = np.float32(alpha)
+        self._gamma_f32 = np.float32(gamma)
+
         # Some required sanity checks
         assert (page_size_bytes & (page_size_bytes-1)) == 0, \
             f"Page size must be a power of 2. Given {page_size_bytes} instead"
@@ -62,7 +92,9 @@ class DeltaQTable:
 
     def _create(self):
         """ Creates the delta table based on the parameters """
-        self.delta_q_table = np.zeros(shape=(self.n_delta_q_entries, self.n_cache_line_offsets))
+        # The Q-values are exponential averages of small integer rewards, so float32 is plenty and halves the
+        # memory traffic of the row scans compared to float64
+        self.delta_q_table = np.zeros(shape=(self.n_delta_q_entries, self.n_cache_line_offsets), dtype=np.float32)
 
     def _get_column_index(self, delta):
         """ Returns the index of the column for the given delta """
@@ -74,15 +106,15 @@ class DeltaQTable:
 
     def get_next_offset(self, delta_signature):
         """ Returns the offset for the current signature """
-        if np.random.uniform() < self.epsilon:
+        if random.random() < self.epsilon:
             # Alright, exploration time. The prefetch might be a terrible one, but exploration is needed !
             # NOTE: There is no need for a scheduler to decay the exploration rate over time. The reason being
             #       if the access pattern changes, then the Q-values will become invalid. So there is a need to start
             #       exploration yet again. Since there is no way of knowing when the pattern changes, keep the rate
             #       constant. Hence no need to decay it :)
-            delta_idx = np.random.choice(range(self.delta_q_table.shape[1]))
+            delta_idx = random.randrange(self.n_cache_line_offsets)
         else:
-            delta_idx = self.delta_q_table[delta_signature, :].argmax()
+            delta_idx = _row_argmax(self.delta_q_table, delta_signature)
 
         delta = self._get_delta_from_idx(delta_idx)
         actual_offset = delta * self.cache_line_size_bytes
@@ -92,19 +124,20 @@ class DeltaQTable:
         """ Returns a reference of the signature hashing method. Needed by the prefetcher """
         return self.signature_hasher
 
-    def update(self, signature, delta, reward):
+    def update(self, signature, delta, reward, next_signature):
         """
         Responsible for updating the given entry (indexed using the signature) with the supplied values
         Applies Q-learning update rule:
             Q[S,A] = Q[S,A] + alpha*(reward + gamma* max_A(Q[S_next, A]) - Q[S,A])
+
+        next_signature must be the signature that follows the given one with the given delta, i.e. the one
+        given by the signature hasher (see get_signature_hasher())
         """
 
         s_curr = signature
         a_curr = self._get_column_index(delta)
-
-        s_next = self.signature_hasher.next_signature(s_curr, delta)  # Index of the next entry
-        a_next = self.delta_q_table[s_next].argmax()  # Q-learning requires max q-value of the action of next entry
+        s_next = next_signature     # Index of the next entry
 
         # Now apply the Q-Learning update rule on the current value
-        self.delta_q_table[s_curr, a_curr] += self.alpha*(reward + self.gamma*self.delta_q_table[s_next, a_next] -
-                                                          self.delta_q_table[s_curr, a_curr])
+        # Q-learning requires max q-value of the action of next entry, which is found inside the compiled kernel
+        _q_update(self.delta_q_table, s_curr, a_curr, s_next, self._alpha_f32, self._gamma_f32, reward)
@@ -62,35 +62,28 @@ class QFetcher:
 
         self.signature_hasher = self.delta_q_table.get_signature_hasher()
 
-    def start(self, ip_trace, load_trace):
+    def start(self, ip_trace, addr_trace, tag_trace, cache_blk_trace):
         """ Starts the prefetcher (>_<)"""
 
-        delta_signature = 0  # Initial value of the delta signature
-        _, prev_load_tag, prev_cache_blk = load_trace[0]
+        # Find out the page jumps, the deltas and the delta signatures of the whole trace beforehand. None of them
+        # depends on what the prefetcher has learned so far
+        page_jumped = (tag_trace[1:] != tag_trace[:-1])
+        deltas = cache_blk_trace[1:] - cache_blk_trace[:-1]
 
-        # Start from the second address in the address trace
-        for curr_ip, curr_load_tuple in tqdm(zip(ip_trace[1:], load_trace[1:])):
-
-            curr_load_addr, curr_load_tag, curr_cache_blk = curr_load_tuple     # Unpack the load address's tuple
+        # If there was a page change, the delta is adjusted before calculating the delta signature. This will be
+        # required for next prefetch request
+        deltas += page_jumped * self.cache_blks_per_page
+        signatures = self.signature_hasher.signatures_from_deltas(deltas)
 
-            # Check if there is a page jump
-            page_jumped = (curr_load_tag != prev_load_tag)
-            delta = curr_cache_blk - prev_cache_blk
+        # Start from the second address in the address trace
+        for i in tqdm(range(1, addr_trace.shape[0])):
+            delta_signature = signatures[i-1]
 
             # If there was a page change, we do not issue a prefetch request
-            # But we update the delta. This will be required for next prefetch request
-            # NOTE: Don't move signature calculation above here. The delta is not fixed until we check for a page
-            #       change. So we need to avoid calculating the delta signature before it is finalized
-            if page_jumped:
-                delta += self.cache_blks_per_page
-                delta_signature = self.signature_hasher.next_signature(delta_signature, delta)
-                self.check_if_prefetched(curr_load_addr, delta_signature)
+            if page_jumped[i-1]:
+                self.check_if_prefetched(addr_trace[i], delta_signature)
             else:
-                delta_signature = self.signature_hasher.next_signature(delta_signature, delta)
-                self.issue_prefetch(curr_ip, curr_load_addr, curr_cache_blk, delta_signature)
-
-            prev_load_tag = curr_load_tag
-            prev_cache_blk = curr_cache_blk
+                self.issue_prefetch(ip_trace[i], addr_trace[i], cache_blk_trace[i], delta_signature)
 
     def check_if_prefetched(self, load_addr, delta_signature):
         """ Checks if a particular load address that lead to a page change was prefetched previously """
@@ -107,15 +100,17 @@ class QFetcher:
         delta_idx, delta_next, offset = self.delta_q_table.get_next_offset(delta_signature)
         pref_addr = curr_load_addr + offset
 
-        invalid_prefetch = (delta_next + curr_cache_blk > self.delta_q_table.largest_delta) or \
-                           (delta_next + curr_cache_blk < 0)
+        # The prefetched block must lie within [0, largest_delta] of the current page. Since the number of blocks
+        # per page is a power of 2, largest_delta is an all-ones mask and both the bounds can be checked at once:
+        # any bit outside the mask (including the sign bits of a negative block) means it crossed the page
+        invalid_prefetch = ((delta_next + curr_cache_blk) & ~self.delta_q_table.largest_delta) != 0
 
         # Insert the prefetch request into the reward tracker table
         self.reward_tracker_table.insert(pref_addr, delta_next, delta_signature, invalid_prefetch)
 
-        # The address should not have the '0x' prefix which is present in hexadecimal notations
-        pref_addr_hex = hex(pref_addr).split('0x')[-1]
         if not invalid_prefetch:
+            # The address should not have the '0x' prefix which is present in hexadecimal notations
+            pref_addr_hex = format(pref_addr, 'x')
             self.output_writer.write(curr_ip, pref_addr_hex, self.delta_q_table.delta_q_table[delta_signature, delta_idx])
 
     def stop(self):
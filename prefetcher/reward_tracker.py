@@ -1,17 +1,22 @@
 # reward_tracker.py -- Module containing the class for Reward-Tracking table
 # The table is of the following format:
 #
-#         Prefetched_Address    Delta    Delta_signature    Reward    Steps    Timestamp    Valid_bit
+#     Prefetched_Address    Delta    Delta_signature    Reward    Steps    Timestamp    Valid_bit    Next_signature
 #
 #         - Prefetched_Address: An address whose prefetch request was issued previously
 #         - Delta:              The offset with which the load address was added to generate the prefetched address
 #         - Delta_signature:    The signature of the pattern with which the delta was chosen
 #         - Reward:             The current reward issued
-#         - Steps:              The number of steps this entry had been present in this table
+#         - Steps:              The (global) step at which this entry was inserted. The number of steps this entry
+#                               had been present in this table is the difference from the current global step
 #         - TimeStamp:          The last time when this entry was accessed. Used for LRU replacement
 #         - Valid_bit:          Indicates if this entry is valid
+#         - Next_signature:     The signature that follows the delta signature with the delta. Computed once when
+#                               the entry is inserted, it is needed to update the delta-Q table for this entry
 #
 #     The table can be implemented as a numpy matrix with the given number of entries and above mentioned columns
+#     Along with the table, two hash indexes over the valid entries are maintained so that the lookups do not have
+#     to scan the whole table: prefetched address -> rows and (prefetched address, delta signature) -> row
 #
 #     For looking up the table whether the current address was prefetched, we only need to check for
 #     an entry with the matching address and the delta signature. Note that the same address might have been
@@ -19,7 +24,8 @@
 #     a pseudo-hit (positive) reward which is less than the actual reward given for a hit.
 
 import numpy as np
-from utils.replacement_policy import LRU
+from numba import njit
+from utils.replacement_policy import OrderedLRU
 
 ################################################
 # Rewards to be issued for a hit in this table
@@ -29,30 +35,53 @@ REWARD_PSEUDO_HIT = 8
 REWARD_MISS = -1
 REWARD_SEVERE_PENALTY = -100
 
-# Columns in the reward table (see the class
-# description below). In case a new column needs
-# to be inserted, write down its name and insert
-# into the list below
-PREF_ADDRESS_COL = 'prefetched_address'
-DELTA_COL = 'delta'
-DELTA_SIG_COL = 'delta_signature'
-REWARD_COL = 'reward'
-STEP_COL = 'step'
-TIMESTAMP_COL = 'timestamp'
-VALID_BIT_COL = 'valid'
+# Indices of the columns in the reward table (see
+# the description above). In case a new column
+# needs to be inserted, give it the next index
+# and insert it into the list below
+COL_PREF_ADDR = 0
+COL_DELTA = 1
+COL_DELTA_SIG = 2
+COL_REWARD = 3
+COL_STEP = 4
+COL_TIMESTAMP = 5
+COL_VALID = 6
+COL_NEXT_DELTA_SIG = 7
 
 REWARD_TABLE_COLUMNS_LIST = [
-    PREF_ADDRESS_COL,
-    DELTA_COL,
-    DELTA_SIG_COL,
-    REWARD_COL,
-    STEP_COL,
-    TIMESTAMP_COL,
-    VALID_BIT_COL
+    COL_PREF_ADDR,
+    COL_DELTA,
+    COL_DELTA_SIG,
+    COL_REWARD,
+    COL_STEP,
+    COL_TIMESTAMP,
+    COL_VALID,
+    COL_NEXT_DELTA_SIG
 ]
 ################################################
 
 
+@njit(cache=True)
+def _tick(reward_table, global_step, steps_per_entry, reward_miss, penalize, invalidated_ids):
+    """
+    Does the per-insert bookkeeping of the reward tracking table in a single pass over the entries:
+        1. Invalidates the valid entries that crossed the total steps (their indices are written to invalidated_ids)
+        2. Penalizes the remaining valid entries with the miss reward, if penalize is set
+    Returns the number of entries that got invalidated
+    """
+    n_invalidated = 0
+    for i in range(reward_table.shape[0]):
+        if reward_table[i, COL_VALID] > 0:
+            if global_step - reward_table[i, COL_STEP] >= steps_per_entry:
+                reward_table[i, COL_VALID] = 0
+                invalidated_ids[n_invalidated] = i
+                n_invalidated += 1
+            elif penalize:
+                reward_table[i, COL_REWARD] += reward_miss
+
+    return n_invalidated
+
+
 class RewardTrackerTable:
     """
     Reward tracking table to issue rewards to the issued prefetches and later used to update
@@ -71,23 +100,26 @@ class RewardTrackerTable:
         self.n_entries = n_entries
         self.steps_per_entry = steps_per_entry
         self.delta_q_table = delta_q_table
+        self.signature_hasher = delta_q_table.get_signature_hasher()
         self.reward_hit = hit_reward
         self.reward_miss = miss_reward
         self.reward_semi_hit = semi_hit_reward
         self.reward_severe_penalty = penalty_reward
         self.columns_list = REWARD_TABLE_COLUMNS_LIST
         self.logical_clock = 0
-
-        # Number the columns appropriately and save them as instance variables
-        for col_idx, column in enumerate(self.columns_list):
-            setattr(self, column, col_idx)
+        self.global_step = 0        # Number of inserts so far. The entries store the step at which they were inserted
 
         # The replacement policy used to find the entries that need to be replaced
         # If this needs to be changed, go to utils/replacement_policy.py and implement a new class
         # by following the instructions there and store an instance of that class below instead
-        self.replacement_policy = LRU()
+        # NOTE: The policy gets notified of every fill, access and invalidation of the entries (see the on_* methods)
+        self.replacement_policy = OrderedLRU(n_entries)
 
         self.reward_table = None
+        self._invalidated_ids = np.zeros(n_entries, dtype=np.int64)    # Filled with the invalidated entries by _tick
+        self._scratch_mask = np.empty(n_entries, dtype=bool)            # Reused for the masks over the entries
+        self._addr_index = {}   # Prefetched address -> set of indices of the valid entries with that address
+        self._key_index = {}    # (Prefetched address, delta signature) -> index of the valid entry with that key
         self._create()  # Create the table and fill it with zeros
 
     def _create(self):
@@ -95,35 +127,44 @@ class RewardTrackerTable:
         self.reward_table = np.zeros(shape=(self.n_entries, len(self.columns_list)),
                                      dtype=np.int64)
 
-        self._pref_addr_idx = getattr(self, PREF_ADDRESS_COL)   # Get the index for the prefetch address column
-        self._step_idx = getattr(self, STEP_COL)                # Get the index for the step column
-        self._valid_bit_idx = getattr(self, VALID_BIT_COL)      # Get the index of the valid bit address column
-        self._delta_sig_idx = getattr(self, DELTA_SIG_COL)      # Get the index of the delta signature column
-        self._delta_idx = getattr(self, DELTA_COL)              # Get the index of the delta column
-        self._reward_idx = getattr(self, REWARD_COL)            # Get the index of the reward column
-        self._time_idx = getattr(self, TIMESTAMP_COL)           # Get the index of the timestamp column
+    def _index_add(self, entry_idx):
+        """ Adds the (valid) entry at the given index to the hash indexes """
+        pref_addr = int(self.reward_table[entry_idx, COL_PREF_ADDR])
+        delta_sig = int(self.reward_table[entry_idx, COL_DELTA_SIG])
+
+        self._addr_index.setdefault(pref_addr, set()).add(entry_idx)
+        self._key_index[(pref_addr, delta_sig)] = entry_idx
+
+    def _index_remove(self, entry_idx):
+        """ Removes the entry at the given index from the hash indexes. Must be done before it gets invalidated """
+        pref_addr = int(self.reward_table[entry_idx, COL_PREF_ADDR])
+        delta_sig = int(self.reward_table[entry_idx, COL_DELTA_SIG])
+
+        addr_entries = self._addr_index[pref_addr]
+        addr_entries.discard(entry_idx)
+        if not addr_entries:
+            del self._addr_index[pref_addr]
+        del self._key_index[(pref_addr, delta_sig)]
 
     def _lookup(self, load_addr, delta_signature):
         """
         Looks up the table for the appropriate entry and returns true if found, else false.
-        Before returning, it also gives the appropriate rewards to the entries that got a hit and
-        the remaining entries
+        Along with it, the indices of the valid entries with matching address and the indices of the
+        valid entries with matching address and delta signature are returned
         """
 
-        # Look if there is a match and whether it is valid
-        pref_matches = (self.reward_table[:, self._pref_addr_idx] == load_addr)
-        delta_sig_matches = (self.reward_table[:, self._delta_sig_idx] == delta_signature)
-
-        valid_entries = (self.reward_table[:, self._valid_bit_idx] > 0)  # Select all those entries with valid bit set
-
+        # Only the valid entries are present in the indexes, so there is no need to check the valid bit
         # NOTE: The matches can be 0, 1 or >1
         # The first case, when this address was not prefetched.
         # The second case arises when the address was prefetched using *ANY* delta signature
         # The third case arises when the address was prefetched using different signatures and is currently present here
-        entry_matches = np.logical_and(pref_matches, valid_entries)
-        entry_and_delta_sig_matches = np.logical_and(entry_matches, delta_sig_matches)
+        entry_matches = list(self._addr_index.get(int(load_addr), ()))
 
-        entry_found = (entry_matches.sum() > 0)
+        # There can be at most one valid entry with the matching address and delta signature
+        entry_and_delta_sig_match = self._key_index.get((int(load_addr), int(delta_signature)))
+        entry_and_delta_sig_matches = [] if entry_and_delta_sig_match is None else [entry_and_delta_sig_match]
+
+        entry_found = (len(entry_matches) > 0)
 
         return entry_found, entry_matches, entry_and_delta_sig_matches
 
@@ -131,59 +172,49 @@ class RewardTrackerTable:
         """ Increments the logical clock for each entry """
         self.logical_clock += 1                     # Increment the timer by 1
         
-    def _increment_steps(self):
-        """ Increases the steps of all entries by 1 """
-        self.reward_table[:, self._step_idx] += 1
-
-    def _update_existing(self, idx_mask):
+    def _update_existing(self, entry_ids):
         """ Updates an existing entry by updating the timestamp """
-        self.reward_table[idx_mask, self._time_idx] = self.logical_clock
-        self.reward_table[idx_mask, self._reward_idx] += self.reward_hit
+        self.reward_table[entry_ids, COL_TIMESTAMP] = self.logical_clock
+        self.reward_table[entry_ids, COL_REWARD] += self.reward_hit
+        for entry_idx in entry_ids:
+            self.replacement_policy.on_access(entry_idx)
 
-    def _invalidate_entries(self):
+    def _invalidate_entries(self, invalidated_ids):
         """
-        Invalidates the entries (ones who crossed the total steps) by updating their corresponding delta_q table
-        and then setting the valid bit in the reward tracking table to 0. If there are no such entries, does
-        nothing
+        Updates the corresponding delta_q table entries of the entries (ones who crossed the total steps) that were
+        invalidated by _tick and removes them from the indexes
         """
-
-        valid_entries_ids_mask = (self.reward_table[:, self._valid_bit_idx] > 0)
-        invalid_entries_ids_mask = (self.reward_table[:, self._step_idx] >= self.steps_per_entry)
-
-        # Only care about the entries that have their valid bit set
-        invalid_entries_ids_mask = invalid_entries_ids_mask * valid_entries_ids_mask
-
-        # If there are no such entries, just return
-        if invalid_entries_ids_mask.sum() == 0:
-            return
-
-        # There exists at least one invalid entries. Process each of them separately
-        invalid_entries = self.reward_table[invalid_entries_ids_mask]
-        for entry in invalid_entries:
-            delta_sig = entry[self._delta_sig_idx]
-            delta = entry[self._delta_idx]
-            reward = entry[self._reward_idx]
+        for entry_idx in invalidated_ids:
+            delta_sig = self.reward_table[entry_idx, COL_DELTA_SIG]
+            delta = self.reward_table[entry_idx, COL_DELTA]
+            reward = self.reward_table[entry_idx, COL_REWARD]
+            next_delta_sig = self.reward_table[entry_idx, COL_NEXT_DELTA_SIG]
 
             # Update the corresponding entries in the deltaQ-table
-            self.delta_q_table.update(delta_sig, delta, reward)
-
-        # Finally reset the valid bit
-        self.reward_table[invalid_entries_ids_mask, self._valid_bit_idx] = 0
+            self.delta_q_table.update(delta_sig, delta, reward, next_delta_sig)
+            self._index_remove(entry_idx)
+            self.replacement_policy.on_invalidate(int(entry_idx))
 
     def _issue_rewards(self, entry_found, all_matches, all_with_delta_sig_matches):
         """ Issues rewards accordingly """
-        all_valid_entries = (self.reward_table[:, self._valid_bit_idx] > 0)
-        self.reward_table[all_valid_entries, self._reward_idx] += self.reward_miss  # Penalize all valid entries
-        self.reward_table[all_matches, self._reward_idx] -= self.reward_miss  # Cancel out penalty on those that matched
+        # Penalize all valid entries. The mask and the addition are done in-place to avoid allocating temporaries
+        all_valid_entries = np.greater(self.reward_table[:, COL_VALID], 0, out=self._scratch_mask)
+        rewards = self.reward_table[:, COL_REWARD]
+        np.add(rewards, self.reward_miss, out=rewards, where=all_valid_entries)
+        self._reward_matches(entry_found, all_matches, all_with_delta_sig_matches)
+
+    def _reward_matches(self, entry_found, all_matches, all_with_delta_sig_matches):
+        """ Issues rewards to the matching entries, given that all the valid entries were already penalized """
+        self.reward_table[all_matches, COL_REWARD] -= self.reward_miss  # Cancel out penalty on those that matched
 
         # Get only the matches that match in addresses, but do not match delta signatures
-        all_matches = np.logical_xor(all_matches, all_with_delta_sig_matches)
+        all_matches = [entry_idx for entry_idx in all_matches if entry_idx not in all_with_delta_sig_matches]
 
         if entry_found:
-            if all_with_delta_sig_matches.sum() > 0:
+            if all_with_delta_sig_matches:
                 self._update_existing(all_with_delta_sig_matches)
 
-            self.reward_table[all_matches, self._reward_idx] += self.reward_semi_hit
+            self.reward_table[all_matches, COL_REWARD] += self.reward_semi_hit
             # TODO: Do we need to update the timestamp for these entries ?
 
     def check_n_give_reward(self, load_addr, delta_signature):
@@ -207,39 +238,48 @@ class RewardTrackerTable:
             1. There is already an entry with matching delta and delta signature
             2. There is no such entry. Need to replace one by LRU policy
         """
-        self._invalidate_entries()  # Invalidate entries, if any
-        self._increment_steps()     # Increment the steps
-
-        addr_found, entry_matches_mask, entry_and_delta_sig_matches_mask = self._lookup(pref_addr, delta_signature)
+        # Invalidate entries (if any) and penalize the remaining valid ones in a single pass
+        # We don't need to penalize other entries if this prefetch was an invalid one
+        # i.e. the prefetcher sent an invalid address to be prefetched (one that crosses page boundaries)
+        # This will happen during exploration most of the time
+        n_invalidated = _tick(self.reward_table, self.global_step, self.steps_per_entry, self.reward_miss,
+                              not invalid_prefetch_flag, self._invalidated_ids)
+        self._invalidate_entries(self._invalidated_ids[:n_invalidated])
+        self.global_step += 1   # Increment the steps (of all the entries at once)
 
-        assert entry_and_delta_sig_matches_mask.sum() <= 1, f"ERROR: Multiple matches for {pref_addr} {delta_signature} found"
+        addr_found, entry_matches, entry_and_delta_sig_matches = self._lookup(pref_addr, delta_signature)
 
         # Replacement will be done, only when necessary. Else this variable remains unused
-        victim_entry_idx = self.replacement_policy.find_victim(self.reward_table[:, self._time_idx],
-                                                               self.reward_table[:, self._valid_bit_idx])
+        victim_entry_idx = self.replacement_policy.find_victim(self.reward_table[:, COL_TIMESTAMP],
+                                                               self.reward_table[:, COL_VALID])
 
-        # We don't need to penalize other entries if this prefetch was an invalid one
-        # i.e. the prefetcher sent an invalid address to be prefetched (one that crosses page boundaries)
-        # This will happen during exploration most of the time
+        # The valid entries were already penalized by _tick, only the matching ones are left to be rewarded
         if not invalid_prefetch_flag:
-            self._issue_rewards(addr_found, entry_matches_mask, entry_and_delta_sig_matches_mask)
+            self._reward_matches(addr_found, entry_matches, entry_and_delta_sig_matches)
 
         # If we didn't find a perfect match, we need to allocate an entry and insert it
         # The victim entry needs to be written back to the delta-Q table, if it is a valid entry
-        if entry_and_delta_sig_matches_mask.sum() == 0:
-            self.delta_q_table.update(self.reward_table[victim_entry_idx, self._delta_sig_idx],
-                                      self.reward_table[victim_entry_idx, self._delta_idx],
-                                      self.reward_table[victim_entry_idx, self._reward_idx])
+        if not entry_and_delta_sig_matches:
+            self.delta_q_table.update(self.reward_table[victim_entry_idx, COL_DELTA_SIG],
+                                      self.reward_table[victim_entry_idx, COL_DELTA],
+                                      self.reward_table[victim_entry_idx, COL_REWARD],
+                                      self.reward_table[victim_entry_idx, COL_NEXT_DELTA_SIG])
+            if self.reward_table[victim_entry_idx, COL_VALID] > 0:
+                self._index_remove(victim_entry_idx)
             # Finally, replace the entry
-            self.reward_table[victim_entry_idx, self._pref_addr_idx] = pref_addr
-            self.reward_table[victim_entry_idx, self._delta_idx] = delta
-            self.reward_table[victim_entry_idx, self._delta_sig_idx] = delta_signature
-            self.reward_table[victim_entry_idx, self._step_idx] = 0
-            self.reward_table[victim_entry_idx, self._time_idx] = self.logical_clock
-            self.reward_table[victim_entry_idx, self._valid_bit_idx] = 1
+            self.reward_table[victim_entry_idx, COL_PREF_ADDR] = pref_addr
+            self.reward_table[victim_entry_idx, COL_DELTA] = delta
+            self.reward_table[victim_entry_idx, COL_DELTA_SIG] = delta_signature
+            self.reward_table[victim_entry_idx, COL_STEP] = self.global_step
+            self.reward_table[victim_entry_idx, COL_TIMESTAMP] = self.logical_clock
+            self.reward_table[victim_entry_idx, COL_VALID] = 1
+            self.reward_table[victim_entry_idx, COL_NEXT_DELTA_SIG] = self.signature_hasher.next_signature(
+                delta_signature, delta)
 
             # Change the reward to give, depending on the whether or not the prefetch request was a valid one
             reward_to_give = self.reward_severe_penalty if invalid_prefetch_flag else self.reward_hit
-            self.reward_table[victim_entry_idx, self._reward_idx] = reward_to_give
+            self.reward_table[victim_entry_idx, COL_REWARD] = reward_to_give
+            self._index_add(victim_entry_idx)
+            self.replacement_policy.on_fill(victim_entry_idx)
 
         self._increment_ticks()     # Increment the logical clock
@@ -1,9 +1,84 @@
 # process_trace.py -- Preprocess the given load trace
 
+import os
 import sys
 import pathlib
 import numpy as np
 import pandas as pd
+from numba import njit, prange
+
+# pyarrow's CSV reader is a lot faster than the one from pandas (multi-threaded, and it reads into a fixed schema
+# instead of inferring the types). It is optional though, pandas is used to read the trace if it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+################################################
+# Lookup tables for parsing hexadecimal digits
+# (indexed by the ASCII value of a character)
+# For a hex digit, the value of the digit and a
+# shift of 4 bits. For anything else, 0 and 0,
+# i.e. the character does not affect the result
+HEX_DIGIT_VALUE_LUT = np.zeros(256, dtype=np.int64)
+HEX_DIGIT_VALUE_LUT[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(0, 10)
+HEX_DIGIT_VALUE_LUT[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+HEX_DIGIT_VALUE_LUT[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+HEX_DIGIT_SHIFT_LUT = np.zeros(256, dtype=np.int64)
+HEX_DIGIT_SHIFT_LUT[np.frombuffer(b'0123456789abcdefABCDEF', dtype=np.uint8)] = 4
+################################################
+
+
+def _make_address_decoder(offset_bits, page_bits, block_mask):
+    """
+    Returns a compiled kernel that splits the addresses for the given configuration. The arguments are captured
+    by the kernel as constants, so the shift amounts and the mask get folded into the generated code
+    NOTE: numba keys the cached kernels by the captured values as well, so each configuration gets its own
+    """
+    offset_bits = int(offset_bits)
+    page_bits = int(page_bits)
+    block_mask = int(block_mask)
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def _split_hex_addresses(data, offsets):
+        """
+        Parses the hexadecimal addresses stored back-to-back as ASCII bytes in data (the i-th one spans
+        data[offsets[i]:offsets[i+1]]) and splits them. Returns the addresses, the tags and the block IDs
+        Any byte that is not a hexadecimal digit (whitespace, padding, the 'x' of a '0x' prefix) is skipped
+        """
+        n_addresses = offsets.shape[0] - 1
+        address_int = np.empty(n_addresses, dtype=np.int64)
+        tag_id = np.empty(n_addresses, dtype=np.int64)
+        block_id = np.empty(n_addresses, dtype=np.int64)
+
+        for i in prange(n_addresses):
+            address = 0
+            for j in range(offsets[i], offsets[i+1]):
+                char = data[j]
+                address = (address << HEX_DIGIT_SHIFT_LUT[char]) | HEX_DIGIT_VALUE_LUT[char]
+
+            address_int[i] = address
+            block_id[i] = (address >> offset_bits) & block_mask     # Extract out the block ID
+            tag_id[i] = address >> page_bits                        # Extract out the tag
+
+        return address_int, tag_id, block_id
+
+    return _split_hex_addresses
+
+
+def _strings_to_buffer(strings):
+    """
+    Packs the given sequence of (ASCII) strings into the format expected by PreprocessAddress.preprocess, i.e.
+    a byte array along with the offsets of each string in it. Strings are padded with zero-bytes to the same length
+    """
+    fixed_width_strings = np.asarray(strings, dtype=np.bytes_)
+    width = fixed_width_strings.dtype.itemsize
+
+    data = fixed_width_strings.view(np.uint8)
+    offsets = np.arange(0, (fixed_width_strings.shape[0] + 1) * width, width, dtype=np.int64)
+    return data, offsets
 
 
 class PreprocessAddress:
@@ -16,10 +91,10 @@ class PreprocessAddress:
         self.page_size = page_size
         self.cache_line_size = cache_line_size
 
-        self.offset_bits = int(np.log2(cache_line_size))
-        self.page_bits = int(np.log2(page_size))
+        self.offset_bits = cache_line_size.bit_length() - 1
+        self.page_bits = page_size.bit_length() - 1
         self.block_bits = self.page_bits - self.offset_bits
-        self.block_mask = int('0b' + ('1' * self.block_bits), base=2)
+        self.block_mask = (1 << self.block_bits) - 1
 
         # Some sanity checks
         assert self.block_bits > 0, f"Invalid cache line size: {cache_line_size}"
@@ -27,14 +102,16 @@ class PreprocessAddress:
         assert cache_line_size <= page_size, \
             f"Block size ({cache_line_size}) is greater than page size ({page_size}) "
 
-    def preprocess(self, address):
-        """ Splits the given address (as a hexadecimal string) """
-        address_int = int(address, base=16)
+        # The kernel that does the actual work, specialized for this configuration
+        self._decode = _make_address_decoder(self.offset_bits, self.page_bits, self.block_mask)
 
-        block_id = (address_int >> self.offset_bits) & self.block_mask  # Extract out the block ID
-        tag_id = address_int >> self.page_bits  # Extract out the tag
-
-        return address_int, tag_id, block_id
+    def preprocess(self, address_data, address_offsets):
+        """
+        Splits the given addresses (hexadecimal strings, stored back-to-back as bytes in address_data with the
+        i-th one spanning address_data[address_offsets[i]:address_offsets[i+1]]). The parsing and splitting is
+        done by a compiled kernel, in parallel
+        """
+        return self._decode(address_data, address_offsets)
 
 
 class PreprocessLoadTrace:
@@ -63,25 +140,86 @@ class PreprocessLoadTrace:
                         'load_ip',
                         'llc_hit_miss']
 
+    def _prefetch_trace_file(self):
+        """
+        Asks the kernel to start reading the whole trace file into the page cache in the background (where supported),
+        so the reader mostly finds the data already in memory instead of waiting on the disk for every block
+        """
+        if not hasattr(os, 'posix_fadvise'):
+            return
+
+        trace_fd = os.open(self.trace_file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(trace_fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(trace_fd)
+
+    def _read_trace_pyarrow(self):
+        """
+        Reads the trace with pyarrow and returns the instruction ID column and the load address column
+        (as the bytes and offsets of the strings, see PreprocessAddress.preprocess)
+        """
+        read_options = pa_csv.ReadOptions(column_names=self.columns)
+        convert_options = pa_csv.ConvertOptions(include_columns=[self.ip_address, self.load_address],
+                                                column_types={self.ip_address: pa.int64(),
+                                                              self.load_address: pa.large_string()})
+
+        # The file is memory-mapped (read-only), so the reader parses straight from the page cache instead of
+        # copying the file into buffers of its own first
+        with pa.memory_map(str(self.trace_file_path), 'r') as trace_file:
+            trace_table = pa_csv.read_csv(trace_file, read_options=read_options, convert_options=convert_options)
+
+        # The buffers of the (large) string array are [validity bitmap, int64 offsets, bytes], so they can
+        # be used as they are, without creating a python string for every address
+        load_addresses = trace_table.column(self.load_address).combine_chunks()
+        _, offsets_buffer, data_buffer = load_addresses.buffers()
+        address_offsets = np.frombuffer(offsets_buffer, dtype=np.int64)
+        address_offsets = address_offsets[load_addresses.offset:load_addresses.offset + len(load_addresses) + 1]
+        address_data = np.frombuffer(data_buffer, dtype=np.uint8)
+
+        return trace_table.column(self.ip_address).to_numpy(), address_data, address_offsets
+
+    def _read_trace_pandas(self):
+        """
+        Reads the trace with pandas and returns the instruction ID column and the load address column
+        (as the bytes and offsets of the strings, see PreprocessAddress.preprocess)
+        """
+        # Need to add the columns because the trace file does not have them. Only the two needed columns are parsed
+        # and their types are given, so that pandas doesn't need to infer them
+        trace_df = pd.read_csv(self.trace_file_path,
+                               header=None,
+                               names=self.columns,
+                               usecols=[self.ip_address, self.load_address],
+                               dtype={self.ip_address: np.int64, self.load_address: str},
+                               engine='c')
+        address_data, address_offsets = _strings_to_buffer(trace_df[self.load_address].to_numpy())
+        return trace_df[self.ip_address].to_numpy(dtype=np.int64), address_data, address_offsets
+
     def preprocess(self):
         """ Read and extract the load/store column """
-        trace_df = None
+        trace_ip_seq = None
+        address_data = None
+        address_offsets = None
 
         print(f'Trying to load trace file: {self.trace_file} ... ')
 
         try:
-            trace_df = pd.read_csv(self.trace_file_path)
+            self._prefetch_trace_file()
+            if pa is not None:
+                trace_ip_seq, address_data, address_offsets = self._read_trace_pyarrow()
+            else:
+                trace_ip_seq, address_data, address_offsets = self._read_trace_pandas()
         except FileNotFoundError:
             print(f'Trace file "{self.trace_file}" does not exist')
             sys.exit(1)
 
         print('Trace file loaded successfully. Starting to preprocess it ... ')
 
-        trace_df.columns = self.columns         # Need to add the columns because the trace file does not have them
-        trace_load_seq = trace_df[self.load_address].apply(self.address_preprocess.preprocess).values
-        trace_ip_seq = trace_df[self.ip_address].values
+        trace_addr_seq, trace_tag_seq, trace_block_seq = self.address_preprocess.preprocess(address_data,
+                                                                                             address_offsets)
 
         print(f'Preprocessing done ... {trace_ip_seq.shape[0]} addresses in total.')
-        # NOTE: The load address column has all the values as tuples of the form
-        #                           (address, tag, block_id)
-        return trace_ip_seq, trace_load_seq
+        # NOTE: The instruction IDs are returned as an int64 array and the load addresses are returned as
+        #       three parallel int64 arrays (struct-of-arrays)
+        #                           address, tag, block_id
+        return trace_ip_seq, trace_addr_seq, trace_tag_seq, trace_block_seq
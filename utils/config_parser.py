@@ -2,7 +2,6 @@
 
 import json
 import pathlib
-from collections import OrderedDict
 
 
 class ConfigParser:
@@ -21,13 +20,13 @@ class ConfigParser:
         self.output_config_key = "output_config"
 
     def parse(self):
-        config_file = None
+        config_bytes = None
         parsed_config = None
 
         print(f'Trying to parse {self.config_file} ... ')
 
         try:
-            config_file = open(self.config_file_path, 'r')
+            config_bytes = self.config_file_path.read_bytes()
         except FileNotFoundError:
             print(f'Config file ({self.config_file}) does not exist')
             exit(1)
@@ -35,7 +34,7 @@ class ConfigParser:
         # Might face some issues in decoding the json file
         # due to invalid syntax or something
         try:
-            parsed_config = json.load(config_file, object_hook=OrderedDict)
+            parsed_config = json.loads(config_bytes)
         except json.JSONDecodeError:
             print(f'Error parsing the config file ({self.config_file})')
 
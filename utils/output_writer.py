@@ -1,8 +1,15 @@
 # output_writer.py -- Module containing the class for generating the output
 
-import os
 import pathlib
 
+################################################
+# Size of the buffers (in bytes) of the output
+# files. The rows are written to the files as
+# they come, so this decides how often they
+# actually get written out
+OUTPUT_BUFFER_SIZE_BYTES = 1 << 20
+################################################
+
 
 class OutputWriter:
     """
@@ -21,35 +28,24 @@ class OutputWriter:
         self.output_pred_path = pathlib.Path(output_dir) / output_pred_file
         self.output_q_path = pathlib.Path(output_dir) / output_q_file
 
-        # Create the directory if it does not exist yet
-        # NOTE: The current working directory is set to the root directory of the project
-        if output_dir not in os.listdir():
+        # Create the directory (along with the missing parents) if it does not exist yet
+        # NOTE: A relative path is taken relative to the current working directory, i.e. the root directory
+        #       of the project
+        output_dir_path = pathlib.Path(output_dir)
+        if not output_dir_path.is_dir():
             print(f'Output directory {output_dir} does not exist. Creating one ... ')
-            os.mkdir(output_dir)
+        output_dir_path.mkdir(parents=True, exist_ok=True)
 
         # IMPORTANT: This will overwrite the files if they already exist
-        self.opened_output_file = open(self.output_pred_path, 'w')
-        self.opened_q_val_file = open(self.output_q_path, 'w')
-
-        # Create the buffers to store the things to write
-        self.pred_buffer = []
-        self.q_buffer = []
+        self.opened_output_file = open(self.output_pred_path, 'w', buffering=OUTPUT_BUFFER_SIZE_BYTES)
+        self.opened_q_val_file = open(self.output_q_path, 'w', buffering=OUTPUT_BUFFER_SIZE_BYTES)
 
     def write(self, instr_id, prefetch_addr, q_value):
-        """ Appends an entry into the output file buffers """
-        self.pred_buffer.append((instr_id, prefetch_addr))
-        self.q_buffer.append(q_value)
+        """ Writes an entry into the output files (it is buffered by the files themselves) """
+        self.opened_output_file.write(f'{instr_id} {prefetch_addr.strip()}\n')
+        self.opened_q_val_file.write(f'{q_value}\n')
 
     def close(self):
-        """ Marks the end of output generation by dumping the contents into the files and closing them """
-        for instr_id, prefetch_addr in self.pred_buffer:
-            self.opened_output_file.write(f'{instr_id} {prefetch_addr.strip()}\n')
-
-        for q_val in self.q_buffer:
-            self.opened_q_val_file.write(f'{q_val}\n')
-
-        self.pred_buffer = []
-        self.q_buffer = []
-
+        """ Marks the end of output generation by flushing the remaining contents into the files and closing them """
         self.opened_output_file.close()
         self.opened_q_val_file.close()
\ No newline at end of file
@@ -2,6 +2,21 @@
 #                          All the policies must inherit
 
 import numpy as np
+from numba import njit
+from collections import OrderedDict
+
+
+@njit(cache=True)
+def _lru_victim(logical_ctrs, valid_bits):
+    """ Returns the index of the first invalid entry if there is any, else the one with the least counter value """
+    victim_idx = 0
+    for i in range(valid_bits.shape[0]):
+        if valid_bits[i] != 1:
+            return i
+        if logical_ctrs[i] < logical_ctrs[victim_idx]:
+            victim_idx = i
+
+    return victim_idx
 
 
 class ReplacementPolicyBase:
@@ -21,15 +36,63 @@ class ReplacementPolicyBase:
         """ Checks for invalid entries and returns the index if it exists """
         return np.any(valid_bits != 1)
 
+    # Following are called by the container whenever the state of an entry changes. Policies that keep their own
+    # bookkeeping (instead of relying on logical_ctrs and valid_bits) need to override them
+
+    def on_fill(self, entry_idx):
+        """ Called when an entry gets filled with new data (and becomes valid) """
+        pass
+
+    def on_access(self, entry_idx):
+        """ Called when a valid entry gets accessed, i.e. its logical counter gets updated """
+        pass
+
+    def on_invalidate(self, entry_idx):
+        """ Called when an entry gets invalidated """
+        pass
+
 
 class LRU(ReplacementPolicyBase):
     """ The class for least-recently used policy """
 
     def find_victim(self, logical_ctrs, valid_bits):
-        """ Picks the victim with the least counter value """
-        if self.check_invalid_entry(valid_bits):
-            victim_idx = valid_bits.argmin()
-        else:
-            victim_idx = logical_ctrs.argmin()
+        """ Picks the (first) invalid entry if there is any, else the victim with the least counter value """
+        # Both the cases are handled in a single compiled pass over the entries, which stops at the first invalid one
+        return _lru_victim(logical_ctrs, valid_bits)
+
+
+class OrderedLRU(ReplacementPolicyBase):
+    """
+    The class for least-recently used policy that keeps the invalid entries and the recency order of the valid
+    entries by itself, so the victim is found without scanning logical_ctrs and valid_bits every time.
+    The container must call the on_* methods whenever the state of an entry changes
+    """
+
+    def __init__(self, n_entries):
+        # The invalid entries are kept as a bitmask (bit i is set iff entry i is invalid), initially all of them
+        # The invalid entry with the least index is then the lowest set bit, found without any scan
+        self.free_entries_mask = (1 << n_entries) - 1
+        self.recency_order = OrderedDict()          # Valid entries, from the least recently used to the most
+
+    def find_victim(self, logical_ctrs, valid_bits):
+        """ Picks the invalid entry with the least index if there is any, else the least recently used one """
+        if self.free_entries_mask:
+            lowest_free_bit = self.free_entries_mask & -self.free_entries_mask
+            return lowest_free_bit.bit_length() - 1
+
+        return next(iter(self.recency_order))
+
+    def on_fill(self, entry_idx):
+        """ Marks the entry as valid and the most recently used one """
+        self.free_entries_mask &= ~(1 << entry_idx)
+        self.recency_order[entry_idx] = None
+        self.recency_order.move_to_end(entry_idx)
+
+    def on_access(self, entry_idx):
+        """ Marks the entry as the most recently used one """
+        self.recency_order.move_to_end(entry_idx)
 
-        return victim_idx
+    def on_invalidate(self, entry_idx):
+        """ Moves the entry from the recency order to the invalid entries """
+        del self.recency_order[entry_idx]
+        self.free_entries_mask |= (1 << entry_idx)
@@ -1,5 +1,47 @@
 # signature_hash.py -- Module containing the class to hash the signatures
 
+import numpy as np
+from numba import njit
+
+
+# Compiled versions of SignatureHash.next_signature, for hashing a whole sequence of deltas at once
+# They must mirror the arithmetic in SignatureHash.next_signature
+
+@njit(inline='always')
+def _to_sign_magnitude(delta):
+    """ Same as the sign-magnitude conversion in SignatureHash.next_signature """
+    if delta >= 0:
+        return delta
+
+    magnitude = -delta
+    n_bits = 0
+    remaining = magnitude
+    while remaining > 0:
+        n_bits += 1
+        remaining >>= 1
+
+    return (1 << n_bits) | magnitude
+
+
+@njit(inline='always')
+def _next_signature(signature, delta, n_shifts, signature_mask):
+    """ Same as SignatureHash.next_signature """
+    return ((signature << n_shifts) ^ _to_sign_magnitude(delta)) & signature_mask
+
+
+@njit(cache=True, nogil=True)
+def _signatures_from_deltas(deltas, n_shifts, signature_mask):
+    """ Returns the signature after each of the given deltas, starting from a signature of 0 """
+    signatures = np.empty(deltas.shape[0], dtype=np.int64)
+
+    signature = 0
+    for i in range(deltas.shape[0]):
+        signature = _next_signature(signature, deltas[i], n_shifts, signature_mask)
+        signatures[i] = signature
+
+    return signatures
+
+
 class SignatureHash:
     """
     Class responsible for generating "signatures" from a delta sequence.
@@ -7,32 +49,30 @@ class SignatureHash:
     def __init__(self, signature_bits, n_shifts, max_delta_val):
         self.signature_bits = signature_bits        # Number of bits to represent a hashed signature
         self.n_shifts = n_shifts                    # Number of bits to shift before XOR-ing
+        self.signature_mask = (1 << signature_bits) - 1
 
         # The maximum number of bits to store the delta in a sign-magnitude manner
-        # For example, bin(127) = "0b1111111"
-        # Splitting with '0b' will give ["", "1111111"]
-        # Take the last part and find the length will give the number of bits
+        # For example, (127).bit_length() = 7, i.e. the number of bits in "1111111"
         # Add 1 to store the sign-magnitude
-        self.max_bits_per_delta = len(bin(max_delta_val).split('0b')[-1]) + 1
-
-    def _to_sign_magnitude(self, delta):
-        """
-        Converts the given delta to sign-magnitude format with (self.max_bits_per_delta + 1) bits
-        The MSB corresponds to the sign of the value: 0 means positive, 1 means negative
-        """
-        bin_delta = bin(delta).split('0b')[-1]
-        if delta < 0:
-            bin_delta = '1' + bin_delta
-        else:
-            bin_delta = '0' + bin_delta
-
-        return int(bin_delta, base=2)
+        self.max_bits_per_delta = int(max_delta_val).bit_length() + 1
 
     def next_signature(self, curr_signature, delta):
         """ Generates the next signature and returns it """
-        sign_mag_delta = self._to_sign_magnitude(delta)
-        new_signature = (curr_signature << self.n_shifts) ^ sign_mag_delta
+
+        # Convert the delta to sign-magnitude format: the magnitude with a 1 (negative) prepended to its MSB
+        # A non-negative delta is already in that format (prepending a 0 does not change the value)
+        # NOTE: This is done with integer operations (instead of going through the binary string) as this is
+        #       called for every prefetch that gets inserted into the reward tracking table
+        if delta < 0:
+            magnitude = -int(delta)
+            delta = (1 << magnitude.bit_length()) | magnitude
 
         # Keep only the last "signature_bits" of the signature
-        new_signature = new_signature & ((1 << self.signature_bits) - 1)
-        return new_signature
+        return ((curr_signature << self.n_shifts) ^ delta) & self.signature_mask
+
+    def signatures_from_deltas(self, deltas):
+        """
+        Generates the signatures for a whole sequence of deltas (starting from a signature of 0) and returns them.
+        The i-th signature is the one after the i-th delta. Much faster than calling next_signature in a loop
+        """
+        return _signatures_from_deltas(deltas, self.n_shifts, self.signature_mask)